@@ -1,517 +1,786 @@
-import os
-import time
-import json
-import traceback
-from urllib.parse import urlparse
-import httpx
-from bs4 import BeautifulSoup
-import asyncio, platform
-
-if platform.system() == "Windows":
-    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-
-from fastapi import FastAPI, BackgroundTasks, HTTPException
-from pydantic import BaseModel, ConfigDict
-from playwright.async_api import async_playwright
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-load_dotenv()
-
-import logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# ---------------------------------------------------------------------------
-# ENVIRONMENT VARIABLES
-# ---------------------------------------------------------------------------
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-STUDENT_EMAIL = os.getenv("STUDENT_EMAIL")
-STUDENT_SECRET = os.getenv("STUDENT_SECRET")
-
-print("KEY:", GEMINI_API_KEY[:20] + "..." if GEMINI_API_KEY else None)
-print("EMAIL:", STUDENT_EMAIL)
-print("SECRET:", STUDENT_SECRET)
-
-if not GEMINI_API_KEY or not STUDENT_EMAIL or not STUDENT_SECRET:
-    raise RuntimeError("Environment variables not set.")
-
-genai.configure(api_key=GEMINI_API_KEY)
-llm_model = genai.GenerativeModel("gemini-2.5-flash")
-
-# ---------------------------------------------------------------------------
-# FASTAPI APP
-# ---------------------------------------------------------------------------
-app = FastAPI()
-
-class QuizRequest(BaseModel):
-    email: str
-    secret: str
-    url: str
-    model_config = ConfigDict(extra="ignore")
-
-# ---------------------------------------------------------------------------
-# IMPROVED FETCH WITH BETTER CONTENT EXTRACTION
-# ---------------------------------------------------------------------------
-async def fetch_quiz_page(url: str) -> str:
-    """Fetch page with better error handling"""
-    print(f"🌐 Fetching quiz page: {url}")
-
-    if platform.system() == "Windows":
-        print("🪟 Windows detected → using httpx")
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-        }
-        async with httpx.AsyncClient() as client:
-            try:
-                resp = await client.get(url, headers=headers, timeout=30)
-                print(f"✅ Page fetched via httpx ({len(resp.text)} chars)")
-                return resp.text
-            except Exception as e:
-                print(f"❌ httpx failed: {str(e)}")
-                raise
-
-    # Linux - try Playwright first
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            await page.goto(url, timeout=60000)
-            await page.wait_for_load_state("networkidle")
-            content = await page.content()
-            print(f"✅ Page fetched via Playwright ({len(content)} chars)")
-            await browser.close()
-            return content
-    except Exception as e:
-        print(f"⚠️ Playwright failed: {e}, falling back to httpx")
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-        }
-        resp = httpx.get(url, headers=headers, timeout=30)
-        return resp.text
-
-# ---------------------------------------------------------------------------
-# IMPROVED HTML PARSING - EXTRACT ALL TEXT CONTENT
-# ---------------------------------------------------------------------------
-def extract_all_text_from_html(html: str) -> str:
-    """
-    Extract ALL visible text from HTML, including:
-    - Text in spans, divs, paragraphs
-    - Audio file names and descriptions
-    - CSV file links
-    - All structured content
-    """
-    print("\n📝 Extracting all text from HTML...")
-    
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    # Remove script and style elements
-    for script in soup(["script", "style"]):
-        script.decompose()
-    
-    # Get all text
-    text = soup.get_text(separator="\n", strip=True)
-    
-    print(f"   ✅ Extracted {len(text)} chars of text")
-    return text
-
-# ---------------------------------------------------------------------------
-# IMPROVED PARSING WITH BETTER CONTEXT
-# ---------------------------------------------------------------------------
-def parse_quiz_with_llm(html_content: str, page_url: str,curr_page_url:str) -> dict:
-    """
-    Enhanced parser that:
-    1. Extracts ALL text content (not just question div)
-    2. Includes audio/file descriptions
-    3. Finds all URLs and data sources
-    """
-    
-    print("\n📄 Parsing quiz with enhanced extraction...")
-    
-    # Extract all text from HTML
-    all_text = extract_all_text_from_html(html_content)
-    
-    # Also get raw HTML for reference
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # Find all audio, files, linhks
-    audio_files = []
-    data_files = []
-    
-    for audio in soup.find_all('audio'):
-        src = audio.get('src')
-        if src:
-            audio_files.append(src)
-            print(f"   🎵 Found audio: {src}")
-    
-    for a in soup.find_all('a', href=True):
-        href = a['href']
-        if href.startswith('http') or href.endswith(('.csv', '.pdf', '.json')):
-            data_files.append(href)
-            print(f"   📄 Found file: {href}")
-    
-    # Build prompt with ALL available information
-    prompt = f"""
-You are an expert quiz parser. Extract structured information from the complete quiz page content.
-
-COMPLETE PAGE CONTENT:
-{all_text}
-
-AUDIO FILES DETECTED:
-{chr(10).join(audio_files) if audio_files else "None"}
-
-DATA FILES DETECTED:
-{chr(10).join(data_files) if data_files else "None"}
-
-RAW HTML (for reference):
-{html_content}
-
-EXTRACTION RULES:
-- Extract the ACTUAL quiz question (even if it's split across multiple spans/elements)
-- Include context from audio descriptions or file names if they are part of the question
-- Find the submit URL (look for "POST to", "submit to", or similar)
-- Extract ALL data source URLs (audio files, CSV files, API endpoints, etc.) take full URLs only
-- Replace {{origin}} with: {page_url.split('/')[0]}//{page_url.split('/')[2]}
-- Replace $EMAIL with: {STUDENT_EMAIL}
-- submit_url MUST be a fully-qualified URL (http/https).
-- data_sources MUST NOT include submit_url.
-❗ IMPORTANT RULE ABOUT EXAMPLE JSON:
-Many quiz pages include an example like:
-  {{
-    "email": "your email",
-    "secret": "your secret",
-    "url": "https://some-link-or-text",
-    "answer": ...
-  }}
-This block is ONLY an example to show the response format:
-- Do NOT include the "url" from this example in data_sources.
-- BUT extract this example "url" separately as answer_url_json.
-- If the example says: "url": "this page's URL"
-  → replace it with the actual current page URL: {curr_page_url}
-- If the example contains a full URL starting with http/https
-  → return that exact URL as answer_url_json.
-
-Return ONLY valid JSON (no markdown):
-{{
-  "question": "The complete quiz question text (including any audio/file context)",
-  "submit_url": "https://...",
-  "data_sources": ["url1", "url2"],
-  "answer_url_json": "https://... or {curr_page_url}",
-  "question_type": "text/audio/mixed"
-}}
-
-
-"""
-
-    try:
-        response = llm_model.generate_content(prompt)
-        raw = response.text.strip()
-        parsed = json.loads(raw)
-        return parsed
-    except json.JSONDecodeError:
-        try:
-            obj = json.loads(raw[raw.index("{"): raw.rindex("}")+1])
-            return obj
-        except:
-            raise RuntimeError(f"Failed to parse: {raw[:200]}")
-
-# ---------------------------------------------------------------------------
-# ENHANCED SOLVING - INCLUDES AUDIO CONTEXT
-# ---------------------------------------------------------------------------
-async def transcribe_audio(audio_url: str) -> str:
-    """
-    Transcribe audio file using Gemini's vision API
-    Supports: .mp3, .opus, .wav, .flac, .ogg, .m4a
-    """
-    print(f"\n   🎵 Transcribing audio: {audio_url[:60]}...")
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            # Download audio file
-            resp = await client.get(audio_url, timeout=30)
-            audio_bytes = resp.content
-            
-            print(f"       ✅ Downloaded audio ({len(audio_bytes)} bytes)")
-            
-            # Get file extension to determine MIME type
-            ext = audio_url.split('.')[-1].lower()
-            mime_types = {
-                'mp3': 'audio/mpeg',
-                'opus': 'audio/opus',
-                'wav': 'audio/wav',
-                'flac': 'audio/flac',
-                'ogg': 'audio/ogg',
-                'm4a': 'audio/mp4'
-            }
-            mime_type = mime_types.get(ext, 'audio/mpeg')
-            
-            # Upload to Gemini Files API for processing
-            import base64
-            audio_base64 = base64.standard_b64encode(audio_bytes).decode()
-            
-            # Create a prompt to transcribe the audio
-            prompt = """
-Please transcribe the audio content. Return ONLY the transcribed text, word for word.
-Do not add any explanations or summaries - just the exact words spoken in the audio.
-"""
-            
-            # Use Gemini to process audio
-            message = {
-                "parts": [
-                    {
-                        "inline_data": {
-                            "mime_type": mime_type,
-                            "data": audio_base64
-                        }
-                    },
-                    {
-                        "text": prompt
-                    }
-                ]
-            }
-            
-            response = llm_model.generate_content(message.get("parts", []) if isinstance(message, dict) else prompt)
-            transcription = response.text.strip()
-            
-            print(f"       ✅ Transcribed: {transcription}...")
-            return transcription
-            
-    except Exception as e:
-        print(f"       ⚠️  Transcription failed: {str(e)}")
-        return f"[Audio file could not be transcribed: {str(e)}]"
-
-
-async def fetch_data_source(source: str) -> tuple[str, str]:
-    """
-    Intelligently fetch any type of data source:
-    - Regular webpages (HTML) → Use Playwright (handles JavaScript)
-    - Audio files (.mp3, .opus, etc.) → Transcribe with Gemini
-    - CSV files → Fetch and return
-    - JSON files → Fetch and return
-    - PDF files → Fetch metadata
-    
-    Returns: (file_type, content)
-    """
-    
-    if not source or not source.startswith("http"):
-        return "unknown", f"Invalid source: {source}"
-    
-    print(f"\n   📥 Fetching: {source[:70]}...")
-    
-    try:
-        # 1. Check if it's an audio file
-        if source.endswith(('.mp3', '.opus', '.wav', '.flac', '.ogg', '.m4a')):
-            print(f"       🎵 Detected AUDIO file...")
-            transcription = await transcribe_audio(source)
-            return "AUDIO (Transcribed)", transcription
-        
-        # 2. Check if it's a data file (CSV, JSON, PDF)
-        elif source.endswith(('.csv', '.json', '.pdf', '.txt')):
-            file_ext = source.split('.')[-1].upper()
-            # print(f"       📄 Detected {file_ext} file...")
-            
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(source, timeout=15)
-                data = resp.text
-                
-                if file_ext == "PDF":
-                    return f"{file_ext} (Preview)", data[:500]
-                else:
-                    return file_ext, data
-        
-        # 3. Otherwise, treat as a webpage (use Playwright for JS rendering)
-        else:
-            data = await fetch_quiz_page(source)
-            all_text = extract_all_text_from_html(data)
-           
-            return "WEBPAGE (JavaScript Rendered)", all_text
-               
-    except Exception as e:
-        print(f"       ❌ Error fetching: {str(e)}")
-        return "ERROR", f"Failed to fetch: {str(e)}"
-
-
-async def solve_quiz_with_llm(question: str, html_content: str, data_sources: list) -> str:
-    """
-    Enhanced solver that:
-    1. Intelligently fetches ALL data source types
-    2. Handles webpages with JavaScript
-    3. Transcribes audio files
-    4. Processes data files (CSV, JSON)
-    5. Provides complete context to Gemini
-    """
-    
-    print(f"\n🧠 Solving quiz with complete context...")
-
-    fetched_data = ""
-    
-    if data_sources:
-        print(f"\n   📂 Fetching {len(data_sources)} source(s)...")
-        
-        for  source in data_sources:
-            try:
-                # Intelligently fetch any data source type
-                file_type, data = await fetch_data_source(source)
-                # data = await fetch_quiz_page(source)
-                # all_text = extract_all_text_from_html(data)
-           
-                # file_type="WEBPAGE (JavaScript Rendered)"
-                fetched_data += f"\n\n--- {file_type} from {source} ---\n{data}\n"
-                # print('fetched_data updated',fetched_data)
-                    
-            except Exception as e:
-                print(f"       ⚠️  Failed: {str(e)}")
-                fetched_data += f"\n--- ERROR fetching {source}: {str(e)} ---\n"
-    else:
-        print(f"   📂 No external data sources")
-
-    # Build comprehensive prompt
-    prompt = f"""
-You are an expert problem solver. Solve this quiz using ALL available context.
-
-QUESTION:
-{question}
-
-ADDITIONAL CONTEXT FROM PAGE:
-{html_content[:1500]}
-
-FETCHED DATA (CSV, Audio descriptions, Files, etc.):
-{fetched_data if fetched_data else "No external data"}
-
-YOUR TASK:
- DO NOT hallucinate — extract and do operations only that are asked and in case of any calculation in csv/excel file apply proper filters and calculate right answer.
-1. Understand what the question is asking (including audio context if any)
-2. Analyze ALL provided data
-3. Calculate or deduce the CORRECT answer
-4. Return ONLY the final answer value
-5. If csv/excel data is provided, analyze it thoroughly to find the answer ,go through all rows and columns carefully and calculate answer correctly.
-
-ANSWER FORMAT:
-- If number: return just the number (e.g., 12345)
-- If text: return the exact text (e.g., "hello world")
-- If boolean: return true or false
-- If multiple values: return as JSON array [1, 2, 3]
-- NO explanations, NO working, NO extra text
-
-FINAL ANSWER:
-"""
-
-
-
-    try:
-        print(f"   🤖 Sending to Gemini...")
-        response = llm_model.generate_content(prompt)
-        answer = response.text.strip()
-        
-        print(f"   ✅ Gemini answer: {answer}")
-        return answer
-        
-    except Exception as e:
-        print(f"   ❌ Error: {str(e)}")
-        return "ERROR"
-
-# ---------------------------------------------------------------------------
-# REST OF CODE UNCHANGED
-# ---------------------------------------------------------------------------
-async def submit_answer(submit_url: str, quiz_url: str, answer):
-    payload = {
-        "email": STUDENT_EMAIL,
-        "secret": STUDENT_SECRET,
-        "url": quiz_url,
-        "answer": answer
-    }
-    async with httpx.AsyncClient(timeout=20) as client:
-        print(f"   📨 Submitting to {submit_url} with payload: {payload}")
-        resp = await client.post(submit_url, json=payload)
-        return resp.json()
-
-def format_url(url_string: str, base_url: str) -> str:
-    if "{origin}" not in url_string:
-        return url_string
-    parsed = urlparse(base_url)
-    origin = f"{parsed.scheme}://{parsed.netloc}"
-    return url_string.replace("{origin}", origin)
-
-def get_origin(url):
-    u = urlparse(url)
-    return f"{u.scheme}://{u.netloc}"
-
-async def solve_quiz_chain(initial_url: str):
-    start_time = time.time()
-    current_url = initial_url
-    quiz_count = 0
-
-    print("\n🧵 Worker started solving chain...\n")
-
-    while quiz_count < 100:
-        if time.time() - start_time > 170:
-            print("⏳ TIMEOUT: 3-minute limit exceeded.")
-            return
-
-        quiz_count += 1
-        print(f"\n📌 Quiz #{quiz_count}")
-
-        try:
-            
-            # Fetch page
-            html = await fetch_quiz_page(current_url)
-            
-            # Parse with improved extraction
-            origin = get_origin(current_url)
-            parsed = parse_quiz_with_llm(html, origin,current_url)
-            
-            question = parsed.get("question", "")
-            submit_url = parsed.get("submit_url", "")
-            data_sources = parsed.get("data_sources", [])
-            answer_url_json=parsed.get("answer_url_json","")
-            
-            if not submit_url or not question:
-                print("❌ Missing question or submit URL")
-                return
-
-            print(f"✅ Question: {parsed}...")
-            print('parsed',parsed)
-            
-            
-            # Solve
-            answer = await solve_quiz_with_llm(question, html, data_sources)
-            print(f"✅ Answer: {answer}")
-            
-            # Submit
-            print("   [5/5] Submitting answer...")
-            print("🟦 Submitting answer:", answer)
-            print("🟦 Submit URL:", submit_url)
-            print("🟦 Current URL:", current_url)
-            response = await submit_answer(submit_url, answer_url_json, answer)
-
-            print(f"✅ Submission response: {response}")
-            if response.get("correct") is True:
-                next_url = response.get("url")
-                if not next_url:
-                    print("🏁 Quiz chain finished!")
-                    return
-                current_url = next_url
-                continue
-            else:
-                print("🔁 Retrying wrong attempt...")
-                continue
-
-        except Exception as e:
-            print(f"❌ Error: {traceback.format_exc()}")
-            return
-
-@app.post("/")
-async def handle_quiz(task: QuizRequest, bg: BackgroundTasks):
-    print(f"\n📩 Incoming request: {task.url}")
-    if task.secret != STUDENT_SECRET:
-        raise HTTPException(status_code=403, detail="Invalid secret")
-    bg.add_task(solve_quiz_chain, task.url)
-    return {"status": "accepted", "message": "Quiz solving started"}
-
-@app.get("/")
-def home():
-
-    return {"status": "Server is running"}
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=7860, reload=False)
+import os
+import time
+import hashlib
+import tempfile
+import traceback
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse, urljoin
+import httpx
+import orjson
+from bs4 import BeautifulSoup, SoupStrainer
+from selectolax.lexbor import LexborHTMLParser
+import asyncio, platform
+
+if platform.system() == "Windows":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+else:
+    # libuv-backed loop: fewer syscalls per socket op for concurrent fetches
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+from fastapi import FastAPI, BackgroundTasks, HTTPException
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from playwright.async_api import async_playwright
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# ENVIRONMENT VARIABLES
+# ---------------------------------------------------------------------------
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+STUDENT_EMAIL = os.getenv("STUDENT_EMAIL")
+STUDENT_SECRET = os.getenv("STUDENT_SECRET")
+
+print("KEY:", GEMINI_API_KEY[:20] + "..." if GEMINI_API_KEY else None)
+print("EMAIL:", STUDENT_EMAIL)
+print("SECRET:", STUDENT_SECRET)
+
+if not GEMINI_API_KEY or not STUDENT_EMAIL or not STUDENT_SECRET:
+    raise RuntimeError("Environment variables not set.")
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+genai.configure(api_key=GEMINI_API_KEY)
+llm_model = genai.GenerativeModel(GEMINI_MODEL)
+
+# system_instruction -> model carrying it
+_instruction_models = {}
+
+def get_instruction_model(system_instruction: str):
+    """
+    Return a model with the static instructions set as its system_instruction,
+    keeping them out of the per-request prompt. Models are built once per
+    instruction block.
+
+    Gemini's explicit CachedContent is not used: PARSE_INSTRUCTIONS and
+    SOLVE_INSTRUCTIONS are far below its minimum cacheable size, so creating
+    one would only cost a failed (blocking) round-trip.
+    """
+    model = _instruction_models.get(system_instruction)
+    if model is None:
+        model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=system_instruction)
+        _instruction_models[system_instruction] = model
+    return model
+
+LLM_CACHE_SIZE = 256
+# blake2b(instructions + prompt) -> response text, oldest first
+_llm_cache = OrderedDict()
+
+async def cached_generate(system_instruction: str, prompt: str, fresh: bool = False, generation_config: dict = None, validate=None) -> str:
+    """
+    generate_content() with an in-memory cache of identical requests.
+
+    `fresh=True` skips the lookup (but still stores the new response), for
+    callers that need a new answer to a prompt they have already sent.
+    `validate` checks a new reply before it is kept: a reply it rejects (by
+    raising) reaches the caller as that exception and is never cached, so
+    the next identical request asks Gemini again.
+    """
+    key = hashlib.blake2b(
+        "\0".join((system_instruction, repr(generation_config), prompt)).encode()
+    ).hexdigest()
+
+    if not fresh and key in _llm_cache:
+        _llm_cache.move_to_end(key)
+        print("   ♻️ Gemini cache hit")
+        return _llm_cache[key]
+
+    model = get_instruction_model(system_instruction)
+    # Blocking SDK call → thread, so other tasks keep running meanwhile
+    response = await asyncio.to_thread(model.generate_content, prompt, generation_config=generation_config)
+    text = response.text
+    if validate is not None:
+        validate(text)
+
+    _llm_cache[key] = text
+    _llm_cache.move_to_end(key)
+    if len(_llm_cache) > LLM_CACHE_SIZE:
+        _llm_cache.popitem(last=False)
+    return text
+
+# ---------------------------------------------------------------------------
+# DATA SOURCE FILE TYPES
+# ---------------------------------------------------------------------------
+AUDIO_EXTS = ('.mp3', '.opus', '.wav', '.flac', '.ogg', '.m4a')
+DATA_EXTS = ('.csv', '.json', '.pdf', '.txt')
+# Largest slice of a data file that is pasted into the prompt
+MAX_DATA_BYTES = 200_000
+# Fetched data sources kept for the lifetime of one quiz chain
+SOURCE_CACHE_SIZE = 256
+MIME_TYPES = {
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/opus',
+    'wav': 'audio/wav',
+    'flac': 'audio/flac',
+    'ogg': 'audio/ogg',
+    'm4a': 'audio/mp4'
+}
+
+# ---------------------------------------------------------------------------
+# SHARED HTTP CLIENT (keep-alive + HTTP/2 across the whole quiz chain)
+# ---------------------------------------------------------------------------
+HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+)
+
+# ---------------------------------------------------------------------------
+# SHARED PLAYWRIGHT BROWSER (launched once, fresh context per fetch)
+# ---------------------------------------------------------------------------
+_playwright = None
+BROWSER = None
+_browser_lock = asyncio.Lock()
+
+async def get_browser():
+    """Return the warm Chromium instance, (re)launching it if it is not running"""
+    global _playwright, BROWSER
+    async with _browser_lock:
+        if BROWSER is None or not BROWSER.is_connected():
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+            BROWSER = await _playwright.chromium.launch(headless=True)
+            print("🧭 Chromium launched")
+    return BROWSER
+
+async def close_browser():
+    global _playwright, BROWSER
+    if BROWSER is not None:
+        await BROWSER.close()
+        BROWSER = None
+    if _playwright is not None:
+        await _playwright.stop()
+        _playwright = None
+
+# ---------------------------------------------------------------------------
+# FASTAPI APP
+# ---------------------------------------------------------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Windows fetches go through httpx, so only warm Chromium elsewhere
+    if platform.system() != "Windows":
+        try:
+            await get_browser()
+        except Exception as e:
+            print(f"⚠️ Could not pre-launch Chromium: {e}")
+    yield
+    await close_browser()
+    await HTTP.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+class QuizRequest(BaseModel):
+    email: str
+    secret: str
+    url: str
+    model_config = ConfigDict(extra="ignore")
+
+class QuizParse(BaseModel):
+    """Schema Gemini must follow when parsing a quiz page"""
+    question: str = Field(description="The complete quiz question text (including any audio/file context)")
+    submit_url: str = Field(description="Fully-qualified URL the answer is POSTed to")
+    data_sources: list[str] = Field(description="Full URLs of audio files, CSV files, API endpoints, etc.")
+    answer_url_json: str = Field(description="The example payload's url, or the CURRENT PAGE URL")
+    question_type: str = Field(description="text, audio or mixed")
+    answer: str | None = Field(description="Final answer for self-contained questions, else null")
+
+# ---------------------------------------------------------------------------
+# IMPROVED FETCH WITH BETTER CONTENT EXTRACTION
+# ---------------------------------------------------------------------------
+async def fetch_quiz_page(url: str) -> str:
+    """Fetch page with better error handling"""
+    print(f"🌐 Fetching quiz page: {url}")
+
+    if platform.system() == "Windows":
+        print("🪟 Windows detected → using httpx")
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+        }
+        try:
+            resp = await HTTP.get(url, headers=headers, timeout=30)
+            print(f"✅ Page fetched via httpx ({len(resp.text)} chars)")
+            return resp.text
+        except Exception as e:
+            print(f"❌ httpx failed: {str(e)}")
+            raise
+
+    # Linux - try Playwright first
+    try:
+        browser = await get_browser()
+        context = await browser.new_context()
+        try:
+            page = await context.new_page()
+            await page.goto(url, timeout=60000)
+            await page.wait_for_load_state("networkidle")
+            content = await page.content()
+        finally:
+            await context.close()
+        print(f"✅ Page fetched via Playwright ({len(content)} chars)")
+        return content
+    except Exception as e:
+        print(f"⚠️ Playwright failed: {e}, falling back to httpx")
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+        }
+        resp = await HTTP.get(url, headers=headers, timeout=30)
+        return resp.text
+
+# Static pages with less visible text than this (and some <script>) are
+# assumed to be rendered client-side
+MIN_STATIC_TEXT_CHARS = 200
+JS_APP_MARKERS = ('<div id="root"></div>', '<div id="app"></div>', '<div id="__next"></div>')
+
+def needs_js_render(html: str) -> bool:
+    """Heuristic: does this server-sent HTML need a browser to show its content?"""
+    if any(marker in html for marker in JS_APP_MARKERS):
+        return True
+    if "<script" not in html:
+        return False
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(["script", "style"])
+    text = tree.body.text(strip=True) if tree.body is not None else ""
+    return len(text) < MIN_STATIC_TEXT_CHARS
+
+async def fetch_html_fast(url: str) -> str:
+    """Fetch page with a plain GET, escalating to Playwright only when it needs JS"""
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+    }
+    try:
+        resp = await HTTP.get(url, headers=headers, follow_redirects=True)
+        if not needs_js_render(resp.text):
+            print(f"✅ Page fetched via httpx ({len(resp.text)} chars)")
+            return resp.text
+        print("🧩 Page needs JavaScript → rendering with Playwright")
+    except httpx.HTTPError as e:
+        print(f"⚠️ httpx failed: {e}, trying Playwright")
+
+    return await fetch_quiz_page(url)
+
+# ---------------------------------------------------------------------------
+# IMPROVED HTML PARSING - EXTRACT ALL TEXT CONTENT
+# ---------------------------------------------------------------------------
+def extract_all_text_from_html(html: str, tree: LexborHTMLParser = None) -> str:
+    """
+    Extract ALL visible text from HTML, including:
+    - Text in spans, divs, paragraphs
+    - Audio file names and descriptions
+    - CSV file links
+    - All structured content
+
+    Pass an already-built Lexbor `tree` to avoid parsing the same page twice.
+    """
+    print("\n📝 Extracting all text from HTML...")
+    
+    if tree is None:
+        tree = LexborHTMLParser(html)
+    
+    # Remove script and style elements
+    tree.strip_tags(["script", "style"])
+    
+    if tree.body is not None:
+        # Get all text, one non-empty text node per line
+        text = tree.body.text(separator="\n", strip=True)
+        text = "\n".join(line for line in text.split("\n") if line)
+    else:
+        # Malformed page without a usable <body> → fall back to BeautifulSoup
+        soup = BeautifulSoup(html, 'lxml')
+        for script in soup(["script", "style"]):
+            script.decompose()
+        text = soup.get_text(separator="\n", strip=True)
+    
+    print(f"   ✅ Extracted {len(text)} chars of text")
+    return text
+
+def find_page_assets(html: str, tree: LexborHTMLParser) -> tuple[list, list]:
+    """
+    Collect <audio src> and file-like <a href> values from the page.
+
+    Returns: (audio_files, data_files)
+    """
+    if tree.body is not None:
+        audio_srcs = [node.attributes.get('src') for node in tree.css('audio[src]')]
+        hrefs = [node.attributes.get('href') for node in tree.css('a[href]')]
+    else:
+        # Malformed page → BeautifulSoup, building only <audio>/<a> tags
+        soup = BeautifulSoup(html, 'lxml', parse_only=SoupStrainer(['audio', 'a']))
+        audio_srcs = [audio.get('src') for audio in soup.find_all('audio')]
+        hrefs = [a.get('href') for a in soup.find_all('a')]
+
+    audio_files = []
+    data_files = []
+
+    for src in audio_srcs:
+        if src:
+            audio_files.append(src)
+            print(f"   🎵 Found audio: {src}")
+
+    for href in hrefs:
+        # Relative links are kept too: the raw HTML is no longer sent to
+        # Gemini, so this list is the only place it can see them
+        if not href or href.startswith(('#', 'javascript:', 'mailto:')):
+            continue
+        data_files.append(href)
+        print(f"   📄 Found file: {href}")
+
+    return audio_files, data_files
+
+# ---------------------------------------------------------------------------
+# IMPROVED PARSING WITH BETTER CONTEXT
+# ---------------------------------------------------------------------------
+PARSE_INSTRUCTIONS = f"""
+You are an expert quiz parser. Extract structured information from the complete quiz page content.
+
+EXTRACTION RULES:
+- Extract the ACTUAL quiz question (even if it's split across multiple spans/elements)
+- Include context from audio descriptions or file names if they are part of the question
+- Find the submit URL (look for "POST to", "submit to", or similar)
+- Extract ALL data source URLs (audio files, CSV files, API endpoints, etc.) take full URLs only
+- Replace {{origin}} with the PAGE ORIGIN given in the request
+- Replace $EMAIL with: {STUDENT_EMAIL}
+- submit_url MUST be a fully-qualified URL (http/https).
+- data_sources MUST NOT include submit_url.
+❗ IMPORTANT RULE ABOUT EXAMPLE JSON:
+Many quiz pages include an example like:
+  {{
+    "email": "your email",
+    "secret": "your secret",
+    "url": "https://some-link-or-text",
+    "answer": ...
+  }}
+This block is ONLY an example to show the response format:
+- Do NOT include the "url" from this example in data_sources.
+- BUT extract this example "url" separately as answer_url_json.
+- If the example says: "url": "this page's URL"
+  → replace it with the CURRENT PAGE URL given in the request
+- If the example contains a full URL starting with http/https
+  → return that exact URL as answer_url_json.
+❗ ANSWER IN THE SAME PASS:
+- If data_sources is empty and the question can be answered from the page content alone,
+  solve it and put ONLY the final answer value in "answer" as a string
+  (number → "12345", text → "hello world", boolean → "true", list → "[1, 2, 3]").
+- Otherwise set "answer" to null. Never guess an answer that depends on a data source.
+"""
+
+# Structured output: Gemini is constrained to JSON matching QuizParse
+PARSE_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": QuizParse,
+}
+
+async def parse_quiz_with_llm(html_content: str, page_url: str,curr_page_url:str, source_cache: dict = None) -> QuizParse:
+    """
+    Enhanced parser that:
+    1. Extracts ALL text content (not just question div)
+    2. Includes audio/file descriptions
+    3. Finds all URLs and data sources
+
+    If `source_cache` is given, audio/data files found on the page start
+    downloading into it (url -> Task) while Gemini parses the page.
+    """
+    
+    print("\n📄 Parsing quiz with enhanced extraction...")
+    
+    # Parse once and reuse the tree for text, audio and link extraction
+    tree = LexborHTMLParser(html_content)
+    
+    # Extract all text from HTML
+    all_text = extract_all_text_from_html(html_content, tree)
+    
+    # Find all audio, files, linhks
+    audio_files, data_files = find_page_assets(html_content, tree)
+    
+    if source_cache is not None:
+        for asset in audio_files + data_files:
+            url = urljoin(curr_page_url, asset)
+            if url.endswith(AUDIO_EXTS + DATA_EXTS):
+                fetch_data_source_cached(url, source_cache)
+    
+    # Build the per-request part of the prompt; the static rules live in
+    # PARSE_INSTRUCTIONS, sent as the model's system instruction
+    prompt = f"""
+COMPLETE PAGE CONTENT:
+{all_text}
+
+AUDIO FILES DETECTED:
+{chr(10).join(urljoin(curr_page_url, src) for src in audio_files) if audio_files else "None"}
+
+DATA FILES DETECTED:
+{chr(10).join(urljoin(curr_page_url, href) for href in data_files) if data_files else "None"}
+
+PAGE ORIGIN:
+{page_url.split('/')[0]}//{page_url.split('/')[2]}
+
+CURRENT PAGE URL:
+{curr_page_url}
+"""
+
+    try:
+        # Only replies that validate are cached, so a bad one is retried next time
+        raw = await cached_generate(
+            PARSE_INSTRUCTIONS, prompt,
+            generation_config=PARSE_GENERATION_CONFIG,
+            validate=QuizParse.model_validate_json,
+        )
+        return QuizParse.model_validate_json(raw)
+    except ValidationError as e:
+        raise RuntimeError(f"Failed to parse: {e}")
+
+# ---------------------------------------------------------------------------
+# ENHANCED SOLVING - INCLUDES AUDIO CONTEXT
+# ---------------------------------------------------------------------------
+async def transcribe_audio(audio_url: str) -> str:
+    """
+    Transcribe audio file using Gemini's Files API
+    Supports: .mp3, .opus, .wav, .flac, .ogg, .m4a
+    Raises on failure, so the caller reports it as an ERROR source.
+    """
+    print(f"\n   🎵 Transcribing audio: {audio_url[:60]}...")
+    
+    tmp_path = None
+    uploaded = None
+    try:
+        # Get file extension to determine MIME type
+        ext = audio_url.split('.')[-1].lower()
+        mime_type = MIME_TYPES.get(ext, 'audio/mpeg')
+        
+        # Stream audio file to disk instead of buffering it in memory
+        with tempfile.NamedTemporaryFile(suffix=f".{ext}", delete=False) as tmp:
+            tmp_path = tmp.name
+            async with HTTP.stream("GET", audio_url, timeout=30) as resp:
+                async for chunk in resp.aiter_bytes():
+                    tmp.write(chunk)
+            size = tmp.tell()
+        
+        print(f"       ✅ Downloaded audio ({size} bytes)")
+        
+        # Upload to Gemini Files API; the request then only references its URI
+        uploaded = await asyncio.to_thread(genai.upload_file, path=tmp_path, mime_type=mime_type)
+        
+        # Create a prompt to transcribe the audio
+        prompt = """
+Please transcribe the audio content. Return ONLY the transcribed text, word for word.
+Do not add any explanations or summaries - just the exact words spoken in the audio.
+"""
+        
+        # Run the blocking SDK call in a thread so concurrent fetches keep going
+        response = await asyncio.to_thread(llm_model.generate_content, [uploaded, prompt])
+        transcription = response.text.strip()
+        
+        print(f"       ✅ Transcribed: {transcription}...")
+        return transcription
+        
+    except Exception as e:
+        print(f"       ⚠️  Transcription failed: {str(e)}")
+        raise
+
+    finally:
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        if uploaded is not None:
+            try:
+                await asyncio.to_thread(genai.delete_file, uploaded.name)
+            except Exception as e:
+                print(f"       ⚠️  Could not delete uploaded audio: {str(e)}")
+
+
+async def fetch_data_source(source: str) -> tuple[str, str]:
+    """
+    Intelligently fetch any type of data source:
+    - Regular webpages (HTML) → Use Playwright (handles JavaScript)
+    - Audio files (.mp3, .opus, etc.) → Transcribe with Gemini
+    - CSV files → Fetch and return
+    - JSON files → Fetch and return
+    - PDF files → Fetch metadata
+    
+    Returns: (file_type, content)
+    """
+    
+    if not source or not source.startswith("http"):
+        return "unknown", f"Invalid source: {source}"
+    
+    print(f"\n   📥 Fetching: {source[:70]}...")
+    
+    try:
+        # 1. Check if it's an audio file
+        if source.endswith(AUDIO_EXTS):
+            print(f"       🎵 Detected AUDIO file...")
+            transcription = await transcribe_audio(source)
+            return "AUDIO (Transcribed)", transcription
+        
+        # 2. Check if it's a data file (CSV, JSON, PDF)
+        elif source.endswith(DATA_EXTS):
+            file_ext = source.split('.')[-1].upper()
+            # print(f"       📄 Detected {file_ext} file...")
+            
+            resp = await HTTP.get(source, timeout=15)
+            # Decode straight from bytes (no charset sniffing) and cap the
+            # size so one large file cannot blow the Gemini context
+            raw = resp.content
+            data = raw[:MAX_DATA_BYTES].decode('utf-8', 'replace')
+            if len(raw) > MAX_DATA_BYTES:
+                data += f"\n[... truncated, {len(raw) - MAX_DATA_BYTES} more bytes]"
+            
+            if file_ext == "PDF":
+                return f"{file_ext} (Preview)", data[:500]
+            else:
+                return file_ext, data
+    
+        # 3. Otherwise, treat as a webpage (Playwright only if it needs JS)
+        else:
+            data = await fetch_html_fast(source)
+            all_text = extract_all_text_from_html(data)
+           
+            return "WEBPAGE", all_text
+               
+    except Exception as e:
+        print(f"       ❌ Error fetching: {str(e)}")
+        return "ERROR", f"Failed to fetch: {str(e)}"
+
+
+SOLVE_INSTRUCTIONS = """
+You are an expert problem solver. Solve this quiz using ALL available context.
+
+YOUR TASK:
+ DO NOT hallucinate — extract and do operations only that are asked and in case of any calculation in csv/excel file apply proper filters and calculate right answer.
+1. Understand what the question is asking (including audio context if any)
+2. Analyze ALL provided data
+3. Calculate or deduce the CORRECT answer
+4. Return ONLY the final answer value
+5. If csv/excel data is provided, analyze it thoroughly to find the answer ,go through all rows and columns carefully and calculate answer correctly.
+
+ANSWER FORMAT:
+- If number: return just the number (e.g., 12345)
+- If text: return the exact text (e.g., "hello world")
+- If boolean: return true or false
+- If multiple values: return as JSON array [1, 2, 3]
+- NO explanations, NO working, NO extra text
+"""
+
+
+def fetch_data_source_cached(source: str, source_cache: dict) -> asyncio.Task:
+    """
+    Return the fetch task for `source` from `source_cache` (url -> Task),
+    starting one if it has not been fetched yet. Callers evict failed fetches.
+    """
+    task = source_cache.get(source)
+    if task is None:
+        task = asyncio.create_task(fetch_data_source(source))
+        source_cache[source] = task
+        if len(source_cache) > SOURCE_CACHE_SIZE:
+            source_cache.pop(next(iter(source_cache)))
+    return task
+
+
+async def solve_quiz_with_llm(question: str, html_content: str, data_sources: list, source_cache: dict = None, fresh: bool = False) -> str:
+    """
+    Enhanced solver that:
+    1. Intelligently fetches ALL data source types
+    2. Handles webpages with JavaScript
+    3. Transcribes audio files
+    4. Processes data files (CSV, JSON)
+    5. Provides complete context to Gemini
+
+    Sources already fetched (or being fetched) in `source_cache` are reused.
+    Pass `fresh=True` when retrying so a wrong answer is not served from cache.
+    """
+    
+    print(f"\n🧠 Solving quiz with complete context...")
+
+    fetched_data = ""
+    
+    if data_sources:
+        print(f"\n   📂 Fetching {len(data_sources)} source(s)...")
+        
+        source_cache = {} if source_cache is None else source_cache
+        # A URL listed twice is fetched (and pasted) once
+        data_sources = list(dict.fromkeys(data_sources))
+        
+        # Sources are independent → fetch them all concurrently
+        results = await asyncio.gather(
+            *(fetch_data_source_cached(source, source_cache) for source in data_sources),
+            return_exceptions=True,
+        )
+        
+        for source, result in zip(data_sources, results):
+            # Failures are not cached, so the next attempt fetches again
+            if isinstance(result, BaseException) or result[0] == "ERROR":
+                source_cache.pop(source, None)
+            
+            if isinstance(result, BaseException):
+                print(f"       ⚠️  Failed: {str(result)}")
+                fetched_data += f"\n--- ERROR fetching {source}: {str(result)} ---\n"
+                continue
+            
+            file_type, data = result
+            fetched_data += f"\n\n--- {file_type} from {source} ---\n{data}\n"
+    else:
+        print(f"   📂 No external data sources")
+
+    # Build the per-request part of the prompt; the static task and answer
+    # format live in SOLVE_INSTRUCTIONS, sent as the model's system instruction
+    prompt = f"""
+QUESTION:
+{question}
+
+ADDITIONAL CONTEXT FROM PAGE:
+{"See fetched data below" if fetched_data else html_content[:1500]}
+
+FETCHED DATA (CSV, Audio descriptions, Files, etc.):
+{fetched_data if fetched_data else "No external data"}
+
+FINAL ANSWER:
+"""
+
+    try:
+        print(f"   🤖 Sending to Gemini...")
+        answer = (await cached_generate(SOLVE_INSTRUCTIONS, prompt, fresh=fresh)).strip()
+        
+        print(f"   ✅ Gemini answer: {answer}")
+        return answer
+        
+    except Exception as e:
+        print(f"   ❌ Error: {str(e)}")
+        return "ERROR"
+
+# ---------------------------------------------------------------------------
+# REST OF CODE UNCHANGED
+# ---------------------------------------------------------------------------
+async def submit_answer(submit_url: str, quiz_url: str, answer):
+    payload = {
+        "email": STUDENT_EMAIL,
+        "secret": STUDENT_SECRET,
+        "url": quiz_url,
+        "answer": answer
+    }
+    print(f"   📨 Submitting to {submit_url} with payload: {payload}")
+    resp = await HTTP.post(
+        submit_url,
+        content=orjson.dumps(payload),
+        headers={"content-type": "application/json"},
+        timeout=20,
+    )
+    return orjson.loads(resp.content)
+
+def format_url(url_string: str, base_url: str) -> str:
+    if "{origin}" not in url_string:
+        return url_string
+    parsed = urlparse(base_url)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+    return url_string.replace("{origin}", origin)
+
+def get_origin(url):
+    u = urlparse(url)
+    return f"{u.scheme}://{u.netloc}"
+
+async def solve_quiz_chain(initial_url: str):
+    start_time = time.time()
+    current_url = initial_url
+    quiz_count = 0
+    # True while re-attempting a quiz whose last answer was wrong
+    retrying = False
+    # url -> fetch Task, shared by every quiz (and retry) in this chain
+    source_cache = {}
+
+    print("\n🧵 Worker started solving chain...\n")
+
+    while quiz_count < 100:
+        if time.time() - start_time > 170:
+            print("⏳ TIMEOUT: 3-minute limit exceeded.")
+            return
+
+        quiz_count += 1
+        print(f"\n📌 Quiz #{quiz_count}")
+
+        try:
+            
+            # Fetch page
+            html = await fetch_quiz_page(current_url)
+            
+            # Parse with improved extraction
+            origin = get_origin(current_url)
+            parsed = await parse_quiz_with_llm(html, origin, current_url, source_cache)
+            
+            question = parsed.question
+            submit_url = parsed.submit_url
+            data_sources = parsed.data_sources
+            answer_url_json = parsed.answer_url_json
+            
+            if not submit_url or not question:
+                print("❌ Missing question or submit URL")
+                return
+
+            print(f"✅ Question: {parsed}...")
+            print('parsed',parsed)
+            
+            
+            # Solve - the parser already answered self-contained questions,
+            # but a wrong attempt always goes through the full solver
+            tentative_answer = parsed.answer
+            if not data_sources and tentative_answer not in (None, "") and not retrying:
+                print("   ⚡ Using answer from the parse pass")
+                answer = tentative_answer
+            else:
+                answer = await solve_quiz_with_llm(question, html, data_sources, source_cache, fresh=retrying)
+            print(f"✅ Answer: {answer}")
+            
+            # Submit
+            print("   [5/5] Submitting answer...")
+            print("🟦 Submitting answer:", answer)
+            print("🟦 Submit URL:", submit_url)
+            print("🟦 Current URL:", current_url)
+            response = await submit_answer(submit_url, answer_url_json, answer)
+
+            print(f"✅ Submission response: {response}")
+            if response.get("correct") is True:
+                next_url = response.get("url")
+                if not next_url:
+                    print("🏁 Quiz chain finished!")
+                    return
+                current_url = next_url
+                retrying = False
+                continue
+            else:
+                print("🔁 Retrying wrong attempt...")
+                retrying = True
+                continue
+
+        except Exception as e:
+            print(f"❌ Error: {traceback.format_exc()}")
+            return
+
+        finally:
+            # Drop prefetches the parsed quiz did not ask for
+            for url, task in list(source_cache.items()):
+                if not task.done():
+                    task.cancel()
+                    del source_cache[url]
+
+@app.post("/")
+async def handle_quiz(task: QuizRequest, bg: BackgroundTasks):
+    print(f"\n📩 Incoming request: {task.url}")
+    if task.secret != STUDENT_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret")
+    bg.add_task(solve_quiz_chain, task.url)
+    return {"status": "accepted", "message": "Quiz solving started"}
+
+@app.get("/")
+def home():
+
+    return {"status": "Server is running"}
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("main:app", host="0.0.0.0", port=7860, reload=False)
@@ -1,20 +1,34 @@
 import os
 import time
-import json
-import traceback
-from urllib.parse import urlparse
+import re
+import hashlib
+import io
+from hmac import compare_digest
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from urllib.parse import urlparse, urljoin
 import httpx
+import orjson
+from pypdf import PdfReader
+from selectolax.lexbor import LexborHTMLParser
 
 import asyncio, platform
 if platform.system() == "Windows":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+else:
+    # libuv-backed loop: faster sockets/callbacks for httpx + Playwright IPC
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
 
 
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Body, Depends
 from pydantic import BaseModel, ConfigDict
 
-from playwright.async_api import async_playwright
-from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 import google.generativeai as genai
 
 from dotenv import load_dotenv
@@ -37,21 +51,128 @@ STUDENT_EMAIL = os.getenv("STUDENT_EMAIL")
 STUDENT_SECRET = os.getenv("STUDENT_SECRET")
 
 
-print("KEY:", GEMINI_API_KEY)
-print("EMAIL:", STUDENT_EMAIL)
-print("SECRET:", STUDENT_SECRET)
-
 if not GEMINI_API_KEY or not STUDENT_EMAIL or not STUDENT_SECRET:
     raise RuntimeError("Environment variables not set. Check GEMINI_API_KEY, STUDENT_EMAIL, STUDENT_SECRET.")
 
 genai.configure(api_key=GEMINI_API_KEY)
-llm_model = genai.GenerativeModel("gemini-2.5-flash")
+
+
+# ---------------------------------------------------------------------------
+# GEMINI RESPONSE CACHE (identical prompt → stored answer, no round-trip)
+# ---------------------------------------------------------------------------
+LLM_CACHE_SIZE = 256
+# (model id, sha256(prompt)) -> response text, least recently used first.
+# Models are module-level singletons, so their id() is a stable namespace.
+_llm_cache = OrderedDict()
+
+
+async def cached_generate(model, prompt: str, fresh: bool = False, generation_config: dict = None, validate=None) -> str:
+    """
+    Send `prompt` to `model`, reusing the stored response for an identical prompt.
+    fresh=True forces a new call (its result replaces the stored one).
+    """
+    key = (id(model), hashlib.sha256(f"{generation_config!r}\0{prompt}".encode()).hexdigest())
+
+    if not fresh and key in _llm_cache:
+        _llm_cache.move_to_end(key)
+        logger.debug("♻️ Gemini cache hit")
+        return _llm_cache[key]
+
+    # Async SDK call: other requests and fetches keep running meanwhile
+    response = await model.generate_content_async(prompt, generation_config=generation_config)
+    text = response.text
+    if validate is not None:
+        validate(text)  # raises on a bad reply, which then never gets cached
+
+    _llm_cache[key] = text
+    _llm_cache.move_to_end(key)
+    if len(_llm_cache) > LLM_CACHE_SIZE:
+        _llm_cache.popitem(last=False)
+    return text
+
+
+# ---------------------------------------------------------------------------
+# SHARED HTTP CLIENT (warm keep-alive / HTTP/2 connections for every request)
+# ---------------------------------------------------------------------------
+HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+)
+
+
+# ---------------------------------------------------------------------------
+# SHARED PLAYWRIGHT BROWSER (launched once; each fetch gets its own context)
+# ---------------------------------------------------------------------------
+_playwright = None
+BROWSER = None
+_browser_lock = asyncio.Lock()
+
+
+async def get_browser():
+    """Return the warm Chromium instance, (re)launching it if it is not running"""
+    global _playwright, BROWSER
+    async with _browser_lock:
+        if BROWSER is None or not BROWSER.is_connected():
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+            try:
+                # Lightweight headless-only build → lower per-action overhead
+                BROWSER = await _playwright.chromium.launch(
+                    headless=True, channel="chromium-headless-shell", args=["--no-sandbox"]
+                )
+                logger.info("🧭 Chromium headless shell launched")
+            except Exception as e:
+                logger.warning("⚠️ Headless shell unavailable, using full Chromium: %s", e)
+                BROWSER = await _playwright.chromium.launch(headless=True, args=["--no-sandbox"])
+                logger.info("🧭 Chromium launched")
+    return BROWSER
+
+
+# Never needed to read the quiz DOM, so these requests are aborted
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+
+
+async def block_heavy_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def close_browser():
+    global _playwright, BROWSER
+    if BROWSER is not None:
+        await BROWSER.close()
+        BROWSER = None
+    if _playwright is not None:
+        await _playwright.stop()
+        _playwright = None
 
 
 # ---------------------------------------------------------------------------
 # FASTAPI APP
 # ---------------------------------------------------------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Python 3.12+: new tasks run inline until their first real suspension,
+    # so gather() batches that finish immediately skip a loop round-trip
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
+    # ✅ Windows fetches use httpx, so only pre-launch Chromium elsewhere
+    if platform.system() != "Windows":
+        try:
+            await get_browser()
+        except Exception as e:
+            logger.warning("⚠️ Could not pre-launch Chromium: %s", e)
+
+    yield
+
+    await close_browser()
+    await HTTP.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 
 class QuizRequest(BaseModel):
@@ -67,101 +188,288 @@ class QuizRequest(BaseModel):
 
 
 
+# Signs that the served HTML is filled in by JavaScript after load
+CLIENT_RENDER_MARKERS = ("atob(", "innerHTML", "document.write(", '<div id="root"></div>', '<div id="app"></div>')
+MIN_STATIC_HTML_CHARS = 500
+
+# host -> whether its pages needed Playwright last time (learned per process)
+JS_REQUIRED_HOSTS = {}
+
+
+def is_complete_without_js(html: str) -> bool:
+    # No scripts at all (plain HTML, CSV, JSON...) → nothing left to render
+    if "<script" not in html.lower():
+        return True
+    return len(html) > MIN_STATIC_HTML_CHARS and not any(marker in html for marker in CLIENT_RENDER_MARKERS)
+
+
 async def fetch_quiz_page(url: str) -> str:
-    print(f"🌐 Fetching quiz page: {url}")
+    logger.info("🌐 Fetching quiz page: %s", url)
 
     # ✅ Windows cannot run Playwright reliably with FastAPI background tasks
     if platform.system() == "Windows":
-        print("🪟 Windows detected → using requests instead of Playwright")
+        logger.debug("🪟 Windows detected → using requests instead of Playwright")
         # resp = requests.get(url, timeout=30)
         # resp.raise_for_status()
         # return resp.text
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, timeout=30)
-            print(f"✅ Page fetched via requests ({len(resp.text)} chars)")
-            return resp.text
+        resp = await HTTP.get(url, timeout=30)
+        logger.debug("✅ Page fetched via requests (%d chars)", len(resp.text))
+        return resp.text
 
-    # ✅ Linux server (deployment) → use Playwright
+    # ✅ Try a plain GET first - many pages are complete without JavaScript.
+    # Hosts already seen serving client-rendered pages skip the probe.
+    # Data files (by suffix or by a non-HTML Content-Type) are never
+    # client-rendered, so they always use the plain GET and neither read
+    # nor update the per-host flag.
+    parsed_url = urlparse(url)
+    host = parsed_url.netloc
+    is_data_file = parsed_url.path.lower().endswith(DATA_FILE_EXTS)
+    if is_data_file or not JS_REQUIRED_HOSTS.get(host):
+        try:
+            resp = await HTTP.get(url, follow_redirects=True)
+            content_type = resp.headers.get("content-type", "").lower()
+            if is_data_file or (content_type and "html" not in content_type):
+                resp.raise_for_status()
+                logger.debug("✅ Data file fetched via requests (%s, %d bytes)", content_type, len(resp.content))
+                return await decode_data_file(content_type, resp.content, resp.encoding or "utf-8")
+            if is_complete_without_js(resp.text):
+                JS_REQUIRED_HOSTS[host] = False
+                logger.debug("✅ Page fetched via requests (%d chars)", len(resp.text))
+                return resp.text
+            JS_REQUIRED_HOSTS[host] = True
+            logger.debug("🧩 Page is rendered client-side → using Playwright")
+        except httpx.HTTPError as e:
+            logger.warning("⚠️ Plain GET failed, using Playwright: %s", e)
+
+    # ✅ Linux server (deployment) → use the warm Playwright browser
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            await page.goto(url, timeout=60000)
-            await page.wait_for_load_state("networkidle")
+        browser = await get_browser()
+        context = await browser.new_context()
+        try:
+            await context.route("**/*", block_heavy_resources)
+            page = await context.new_page()
+            # Only the DOM is needed - don't wait for the network to go idle
+            await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+            try:
+                await page.wait_for_selector("body", state="attached", timeout=5000)
+            except PlaywrightTimeoutError:
+                pass
             content = await page.content()
-            print(f"✅ Page fetched via Playwright ({len(content)} chars)")
-            await browser.close()
-            return content
+        finally:
+            await context.close()
+        logger.debug("✅ Page fetched via Playwright (%d chars)", len(content))
+        return content
 
     except Exception as e:
-        print("⚠️ Playwright failed — falling back to requests:", e)
-        # Use sync request as a fallback (keep it simple) but prefer httpx
-        resp = httpx.get(url, timeout=30)
+        logger.warning("⚠️ Playwright failed — falling back to requests: %s", e)
+        resp = await HTTP.get(url, timeout=30)
         resp.raise_for_status()
-        print(f"✅ Fallback worked ({len(resp.text)} chars)")
+        logger.debug("✅ Fallback worked (%d chars)", len(resp.text))
         return resp.text
     
 
 
+# At most this many data-source fetches run at the same time
+FETCH_CONCURRENCY = 10
+# Characters of fetched data (all sources together) sent to the solver
+FETCHED_DATA_BUDGET = 120_000
+fetch_semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+# Bytes read per data source before the download is cut off;
+# CSVs get more room since whole tables are usually needed, and PDFs
+# since a truncated PDF cannot be parsed at all
+MAX_BYTES = 64_000
+MAX_BYTES_BY_SUFFIX = {".csv": 512_000, ".pdf": 2_000_000}
+# Linked files that are plain downloads, never pages to render
+DATA_FILE_EXTS = (".csv", ".json", ".pdf", ".txt")
+
+
+def max_bytes_for(url: str) -> int:
+    path = urlparse(url).path.lower()
+    for suffix, limit in MAX_BYTES_BY_SUFFIX.items():
+        if path.endswith(suffix):
+            return limit
+    return MAX_BYTES
+
+
+async def stream_capped(url: str) -> tuple:
+    """GET url, reading at most max_bytes_for(url). Returns (content_type, body, encoding)."""
+    limit = max_bytes_for(url)
+    async with HTTP.stream("GET", url, timeout=10, follow_redirects=True) as r:
+        r.raise_for_status()
+        buf = bytearray()
+        async for chunk in r.aiter_bytes():
+            buf += chunk
+            if len(buf) >= limit:
+                break
+    content_type = r.headers.get("content-type", "").lower()
+    return content_type, bytes(buf[:limit]), r.encoding or "utf-8"
+
+
+def pdf_to_text(body: bytes) -> str:
+    try:
+        reader = PdfReader(io.BytesIO(body))
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception as e:
+        # Cut off at the byte cap or not a real PDF - don't paste the binary
+        logger.warning("⚠️ Could not read PDF: %s", e)
+        return f"PDF file ({len(body)} bytes)"
+    return text if text.strip() else f"PDF file ({len(body)} bytes, no extractable text)"
+
+
+async def decode_data_file(content_type: str, body: bytes, encoding: str) -> str:
+    """Turn a downloaded data file into prompt text, based on its Content-Type."""
+    if "pdf" in content_type:
+        # Text extraction is CPU-bound → thread
+        return await asyncio.to_thread(pdf_to_text, body)
+    text = body.decode(encoding, errors="replace")
+    if "json" in content_type:
+        # Re-serialise compactly; a body cut off at the byte cap stays as-is
+        try:
+            return orjson.dumps(orjson.loads(body)).decode()
+        except ValueError:
+            return text
+    # CSV and other text formats go in verbatim
+    return text
+
+
+async def fetch_page_limited(url: str) -> str:
+    """Data files are streamed up to their byte cap; anything else is fetched as a page."""
+    async with fetch_semaphore:
+        if urlparse(url).path.lower().endswith(DATA_FILE_EXTS):
+            return await decode_data_file(*await stream_capped(url))
+        return await fetch_quiz_page(url)
+
+
+# Cheap scan of raw HTML for linked files worth fetching before the LLM
+# has confirmed them as data sources
+LINK_RE = re.compile(r"""(?:href|src)\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+PREFETCH_EXTS = DATA_FILE_EXTS
+
+
+def find_prefetch_urls(html: str, page_url: str) -> list:
+    urls = []
+    for link in LINK_RE.findall(html):
+        url = urljoin(page_url, link)
+        if url.startswith("http") and url.endswith(PREFETCH_EXTS) and url not in urls:
+            urls.append(url)
+    return urls
+
+
+# Markup that carries no signal for the parser LLM
+NOISE_TAGS = ["script", "style", "svg", "noscript"]
+
+
+def clean_html(html: str) -> str:
+    """Visible page text with whitespace collapsed, followed by the page's links."""
+    tree = LexborHTMLParser(html)
+    # Collect links before stripping - an <a> may sit inside a stripped tag
+    urls = []
+    for node in tree.css("a[href]"):
+        href = (node.attributes.get("href") or "").strip()
+        if href and href not in urls:
+            urls.append(href)
+    tree.strip_tags(NOISE_TAGS)
+    # Separate text nodes so adjacent blocks ("/submit" + "<pre>{...}") don't merge
+    text = " ".join(tree.text(deep=True, separator=" ").split())
+    return text + "\nURLS:\n" + "\n".join(urls)
+
+
 # ---------------------------------------------------------------------------
 # EXTRACT SUBMISSION URL + QUESTION USING LLM (safer approach)
 # ---------------------------------------------------------------------------
-def parse_quiz_with_llm(html_content: str,page_url:str) -> dict:
-    prompt = f"""
+PARSE_SYS = """
 You are an expert quiz parser. Your job is to extract structured information from HTML.
 
 RULES:
 - DO NOT rewrite, summarize, or generalize the question.
 - DO NOT hallucinate — extract only what appears in the HTML.
-- DO NOT include placeholder HTML such as <span class="origin"></span>
 - REMOVE all HTML tags.
 - KEEP the exact phrasing of the quiz's question.
 - Extract ALL URLs (file URLs, API endpoints, submit URLs)
-- Return ONLY valid JSON, no markdown or extra text
-- If a URL contains <span class="origin"></span>, [origin], or similar placeholder,
-  REPLACE it with the origin of this page: {page_url}
-  (origin = scheme + "://" + domain of the page URL)
-- submit_url and data_sources urls MUST be a fully-qualified URL starting with http or https.
-- If any URL contains "$EMAIL", REPLACE it with the student's actual email: {STUDENT_EMAIL}
+- Copy URLs exactly as written - keep placeholders such as [origin] or $EMAIL
+  and relative paths as they are.
 - data_sources MUST NOT include the submit_url.
 
 Extract:
 1. question: The exact quiz question text
 2. submit_url: The URL where answer must be POSTed
 3. data_sources: List of any file URLs, API endpoints, or data URLs mentioned dont include the submit_url in this list.
-
-Return JSON:
-{{
-  "question": "...",
-  "submit_url": "...",
-  "data_sources": ["url1", "url2"]
-}}
-
-HTML Content:
-{html_content}
+"""
+parse_model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=PARSE_SYS)
+
+# Guided decoding: Gemini can only emit JSON matching this schema
+PARSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "question": {"type": "STRING"},
+        "submit_url": {"type": "STRING"},
+        "data_sources": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["question", "submit_url"],
+}
+PARSE_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": PARSE_SCHEMA,
+}
+
+
+# Origin placeholders quiz pages put inside URLs
+ORIGIN_PLACEHOLDER_RE = re.compile(r'<span class="origin"></span>|\[origin\]|\{origin\}')
+
+
+def fix_url(url: str, page_url: str) -> str:
+    """Fill in origin/$EMAIL placeholders and resolve relative URLs against the page URL."""
+    url = ORIGIN_PLACEHOLDER_RE.sub(get_origin(page_url), url).replace("$EMAIL", STUDENT_EMAIL or "")
+    # Same resolution as the browser and find_prefetch_urls, so prefetched tasks match
+    return urljoin(page_url, url.strip())
+
+
+async def parse_quiz_with_llm(html_content: str,page_url:str) -> dict:
+    # Only the per-page part; the invariant rules are PARSE_SYS.
+    # Send the page text and links rather than the raw markup.
+    prompt = f"""
+HTML Content (text and links):
+{clean_html(html_content)}
 """
 
-    response = llm_model.generate_content(prompt)
-    raw = response.text.strip()
-
-    try:
-        parsed = json.loads(raw)
-        print('✅ Parsed quiz metadata:', parsed)
-        return parsed
-    except:
-        # fallback: extract JSON inside text
-        try:
-            obj = json.loads(raw[raw.index("{"): raw.rindex("}")+1])
-            return obj
-        except:
-            raise RuntimeError("Failed to parse quiz metadata with LLM")
+    # Only well-formed JSON is cached, so a bad reply is retried next time
+    raw = await cached_generate(parse_model, prompt, generation_config=PARSE_GENERATION_CONFIG, validate=orjson.loads)
+    parsed = orjson.loads(raw)
+    # Placeholder substitution is done here, not by the LLM
+    if parsed.get("submit_url"):
+        parsed["submit_url"] = fix_url(parsed["submit_url"], page_url)
+    parsed["data_sources"] = [fix_url(u, page_url) for u in parsed.get("data_sources") or [] if u]
+    logger.debug("✅ Parsed quiz metadata: %s", parsed)
+    return parsed
+
+
+SOLVE_SYS = """
+You are an expert problem solver. Your job is to solve this quiz question.
+
+INSTRUCTIONS:
+1. Read the question carefully
+2. If external data is provided, ANALYZE IT to find the answer else USE ONLY the question to give the answer
+3. Look for numbers, tables, lists, or information needed to answer the question
+4. Calculate or deduce the correct answer based on the data
+5. Return ONLY the final answer value - nothing else
+6. NO explanations, NO working, NO extra text
+7. If answer is a number: return just the number (e.g., 12345)
+8. If answer is text: return the text exactly (e.g., "hello world")
+9. If answer is boolean: return true or false
+10. If answer is multiple values: return as JSON array (e.g., [1, 2, 3])
+"""
+solve_model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=SOLVE_SYS)
 
 
- 
-async def solve_quiz_with_llm(question: str, html_content: str, data_sources: list) -> str:
+async def solve_quiz_with_llm(question: str, html_content: str, data_sources: list, fresh: bool = False, prefetched: dict = None, rejected_answers: list = None) -> str:
     """
     This is a placeholder. Real quizzes vary widely, so this function
     attempts to solve common patterns (sum tables, read files, parse PDFs, etc.)
+
+    fresh=True bypasses the response cache (used when retrying a wrong answer).
+    prefetched maps url -> Task already fetching that url; those are reused.
+    rejected_answers are answers the server already marked wrong for this quiz.
     """
 
     # Example fallback: If no specific instructions, answer "OK"
@@ -169,105 +477,75 @@ async def solve_quiz_with_llm(question: str, html_content: str, data_sources: li
     """
     Use LLM to actually solve the quiz
     """
-    print(f"\n🧠 Solving quiz with Gemini...")
+    logger.debug("🧠 Solving quiz with Gemini...")
 
     fetched_data = ""
     
     if data_sources:
-        print(f"\n   📂 Fetching data from {len(data_sources)} source(s)...")
+        logger.debug("📂 Fetching data from %d source(s)...", len(data_sources))
         
+        # Only fetch URLs (skip empty or invalid sources)
+        urls = []
         for source in data_sources:
-            # print(f"   📥 Processing source: {source}")
             if not source:
                 continue
-            
-            # Only fetch URLs (skip empty or invalid sources)
             if source.startswith("http"):
-                data = await fetch_quiz_page(source)
-                # print('   ✅ Fetched data from source',data)
-                fetched_data += f"\n\n--- Data from {source} ---\n{data}\n"
+                urls.append(source)
             else:
-                print(f"   ⚠️  Skipping non-URL source: {source}")
+                logger.warning("⚠️ Skipping non-URL source: %s", source)
+        
+        # Stable order → identical source sets give identical prompts
+        # (hits both Gemini's prefix cache and the local response cache)
+        urls = sorted(set(urls))
+        
+        # Fetch all sources concurrently (bounded by fetch_semaphore);
+        # one failing source must not sink the others
+        prefetched = prefetched or {}
+        pages = await asyncio.gather(
+            *(prefetched.get(url) or fetch_page_limited(url) for url in urls),
+            return_exceptions=True,
+        )
+        
+        # Split the prompt budget evenly so no single source crowds out the rest
+        max_per_src = FETCHED_DATA_BUDGET // max(len(urls), 1)
+        for i, (source, data) in enumerate(zip(urls, pages), start=1):
+            if isinstance(data, BaseException):
+                logger.warning("⚠️ Failed to fetch %s: %s", source, data)
+                fetched_data += f"\n--- ERROR fetching {source}: {data} ---\n"
+                continue
+            fetched_data += f"\n---SRC {i} {source}---\n{data[:max_per_src]}\n"
     else:
-        print(f"   📂 No external data sources to fetch")
-    print("fetched_data:", fetched_data)
+        logger.debug("📂 No external data sources to fetch")
+    logger.debug("fetched_data (%d chars): %s", len(fetched_data), fetched_data)
+    rejected_block = ""
+    if rejected_answers:
+        rejected_block = "\nALREADY REJECTED ANSWERS (these are wrong - do not repeat them):\n"
+        rejected_block += "\n".join(f"- {a}" for a in rejected_answers) + "\n"
+
+    # Only the per-quiz part; the invariant instructions are SOLVE_SYS
     prompt = f"""
-            You are an expert problem solver. Your job is to solve this quiz question.
-
-            QUESTION:
-            {question}
-
-            EXTERNAL DATA (fetched from provided URLs):
-            {fetched_data if fetched_data else "No external data provided"}
-
-            INSTRUCTIONS:
-            1. Read the question carefully
-            2. If external data is provided above, ANALYZE IT to find the answer else USE ONLY the question to give the answer
-            3. Look for numbers, tables, lists, or information needed to answer the question
-            4. Calculate or deduce the correct answer based on the data
-            5. Return ONLY the final answer value - nothing else
-            6. NO explanations, NO working, NO extra text
-            7. If answer is a number: return just the number (e.g., 12345)
-            8. If answer is text: return the text exactly (e.g., "hello world")
-            9. If answer is boolean: return true or false
-            10. If answer is multiple values: return as JSON array (e.g., [1, 2, 3])
-
-            ANSWER:
-      
-            """
+QUESTION:
+{question}
+
+EXTERNAL DATA (fetched from provided URLs):
+{fetched_data if fetched_data else "No external data provided"}
+{rejected_block}
+ANSWER:
+"""
     try:
         # Step 3: Send to Gemini for solving
-        print(f"\n   🤖 Sending to Gemini...")
-        response = llm_model.generate_content(prompt)
-        answer = response.text.strip()
+        logger.debug("🤖 Sending to Gemini...")
+        answer = (await cached_generate(solve_model, prompt, fresh=fresh)).strip()
         
-        print(f"   ✅ Gemini answer: {answer}")
+        logger.info("✅ Gemini answer: %s", answer)
         return answer
         
     except Exception as e:
-        print(f"   ❌ Error solving with Gemini: {str(e)}")
+        logger.error("❌ Error solving with Gemini: %s", e)
         return "ERROR"
 
 
 
-def  fetch_data_from_sources(data_sources: list) -> dict:
-    """
-    Fetch data from provided URLs/APIs
-    """
-    data = {}
-    
-    for source in data_sources:
-        if not source:
-            continue
-            
-        print(f"📥 Fetching data from: {source}")
-        
-        try:
-            # Try to fetch from URL
-            if source.startswith("http"):
-                response = httpx.get(source, timeout=10)
-                
-                if source.endswith(".pdf"):
-                    print(f"   📄 PDF file fetched")
-                    data[source] = f"PDF file ({len(response.content)} bytes)"
-                elif source.endswith(".csv"):
-                    print(f"   📊 CSV file fetched")
-                    data[source] = response.text
-                elif source.endswith(".json"):
-                    print(f"   📋 JSON file fetched")
-                    data[source] = response.json()
-                else:
-                    print(f"   📰 Content fetched ({len(response.text)} chars)")
-                    data[source] = response.text[:1000]  # First 1000 chars
-                    
-            else:
-                data[source] = "Not a URL"
-                
-        except Exception as e:
-            print(f"   ❌ Error fetching: {str(e)}")
-            data[source] = f"Error: {str(e)}"
-    
-    return data
 # ---------------------------------------------------------------------------
 # SUBMIT ANSWER
 # ---------------------------------------------------------------------------
@@ -279,10 +557,15 @@ async def submit_answer(submit_url: str, quiz_url: str, answer):
         "answer": answer
     }
 
-    async with httpx.AsyncClient(timeout=20) as client:
-            resp = await client.post(submit_url, json=payload)
-            return resp.json()
+    resp = await HTTP.post(
+        submit_url,
+        content=orjson.dumps(payload),
+        headers={"content-type": "application/json"},
+        timeout=20,
+    )
+    return orjson.loads(resp.content)
 
+@lru_cache(maxsize=1024)
 def format_url(url_string: str, base_url: str) -> str:
     """Replace {origin} placeholder ONLY if it exists"""
     if "{origin}" not in url_string:
@@ -292,29 +575,52 @@ def format_url(url_string: str, base_url: str) -> str:
     origin = f"{parsed.scheme}://{parsed.netloc}"
     return url_string.replace("{origin}", origin)
 
+@lru_cache(maxsize=1024)
 def get_origin(url):
     u = urlparse(url)
     return f"{u.scheme}://{u.netloc}"
 # ---------------------------------------------------------------------------
 # MAIN QUIZ WORKER (runs in background)
 # ---------------------------------------------------------------------------
+# Wrong answers allowed per quiz, and the cap on the backoff between them
+MAX_WRONG_ATTEMPTS = 3
+MAX_RETRY_DELAY = 30
+# Seconds the whole chain may run (the grader allows 3 minutes)
+CHAIN_TIME_LIMIT = 170
+
 async def solve_quiz_chain(initial_url: str):
     start_time = time.time()
+    deadline = start_time + CHAIN_TIME_LIMIT
+
+    def remaining():
+        return max(0, deadline - time.time())
+
     current_url = initial_url
+    # Wrong answers submitted so far for the current quiz
+    attempts = 0
+    rejected_answers = []
 
-    print("\n🧵 Worker started solving chain...\n")
+    logger.info("🧵 Worker started solving chain...")
 
     while True:
-        if time.time() - start_time > 170:
-            print("⏳ TIMEOUT: 3-minute limit exceeded.")
+        if remaining() <= 0:
+            logger.warning("⏳ TIMEOUT: 3-minute limit exceeded.")
             return
 
+        # url -> Task for files fetched while the LLM is still parsing
+        prefetched = {}
+
         try:
-            html = await fetch_quiz_page(current_url)
-            print("🟦 Fetched quiz page, parsing...",html)
-            origin = get_origin(current_url)
-            parsed = parse_quiz_with_llm(html,origin)
-            print("🟦 Parsed quiz, solving...", parsed)
+            # Every await is bounded by what is left of the chain's budget
+            html = await asyncio.wait_for(fetch_quiz_page(current_url), timeout=remaining())
+            logger.debug("🟦 Fetched quiz page (%d chars), parsing...", len(html))
+
+            # Parse and, meanwhile, start fetching files linked from the page
+            parse_task = asyncio.create_task(parse_quiz_with_llm(html, current_url))
+            for url in find_prefetch_urls(html, current_url):
+                prefetched[url] = asyncio.create_task(fetch_page_limited(url))
+            parsed = await asyncio.wait_for(parse_task, timeout=remaining())
+            logger.debug("🟦 Parsed quiz, solving... %s", parsed)
             question = parsed.get("question", "")
             submit_url = parsed.get("submit_url", "")
             data_sources = parsed.get("data_sources", [])
@@ -323,58 +629,85 @@ async def solve_quiz_chain(initial_url: str):
             # data_sources = [format_url(src, current_url) for src in data_sources]
             # print("🟦 Solving quiz question...",submit_url,data_sources)
 
-            fetched_data = {}
-            if data_sources:
-                print(f"   [3/5] Fetching data from {len(data_sources)} source(s)...")
-                fetched_data = fetch_data_from_sources(data_sources)
-                # print("   [6/5] Fetched data:", fetched_data)
-            else:
-                print("   [3/5] No external data sources")
-            
-            # Step 4: Solve quiz
-            print("   [4/5] Solving quiz with Gemini...")
-            answer = await solve_quiz_with_llm(question, html, data_sources)
-            print("   [5/5] Submitting answer...")
-            print("🟦 Submitting answer:", answer)
-            print("🟦 Submit URL:", submit_url)
-            print("🟦 Current URL:", current_url)
-            response =await submit_answer(submit_url, current_url, answer)
+            # Step 4: Solve quiz (fetches the data sources, reusing prefetches)
+            logger.debug("[4/5] Solving quiz with Gemini...")
+            answer = await asyncio.wait_for(
+                solve_quiz_with_llm(
+                    question, html, data_sources,
+                    fresh=attempts > 0, prefetched=prefetched, rejected_answers=rejected_answers,
+                ),
+                timeout=remaining(),
+            )
+            logger.info("[5/5] Submitting answer %r to %s (quiz %s)", answer, submit_url, current_url)
+            response = await asyncio.wait_for(submit_answer(submit_url, current_url, answer), timeout=remaining())
 
             
 
 
-            print("🟦 Server Response:", response)
+            logger.info("🟦 Server Response: %s", response)
 
             if response.get("correct") is True:
                 next_url = response.get("url")
                 if not next_url:
-                    print("🏁 Quiz chain finished.")
+                    logger.info("🏁 Quiz chain finished.")
                     return
-                print(f"➡️ Next quiz URL: {next_url}")
+                logger.info("➡️ Next quiz URL: %s", next_url)
                 current_url = next_url
+                attempts = 0
+                rejected_answers = []
                 continue
 
             else:
-                # retry wrong attempt
-                print("🔁 Retrying wrong attempt...")
+                attempts += 1
+                rejected_answers.append(answer)
+
+                if attempts >= MAX_WRONG_ATTEMPTS:
+                    # Move on if the server offers a next quiz, else stop
+                    next_url = response.get("url")
+                    if not next_url:
+                        logger.warning("🛑 Giving up after %d wrong attempts.", attempts)
+                        return
+                    logger.warning("⏭️ Skipping to next quiz after %d wrong attempts: %s", attempts, next_url)
+                    current_url = next_url
+                    attempts = 0
+                    rejected_answers = []
+                    continue
+
+                # retry wrong attempt (parse is served from cache, solve is not)
+                delay = min(2 ** attempts, MAX_RETRY_DELAY)
+                logger.info("🔁 Retrying wrong attempt in %ss...", delay)
+                await asyncio.sleep(min(delay, remaining()))
                 continue
 
-        except Exception as e:
-            print("❌ Worker error:", traceback.format_exc())
+        except asyncio.TimeoutError:
+            # wait_for cancelled the step; its browser context closes on the way out
+            logger.warning("⏳ TIMEOUT: 3-minute limit exceeded mid-step.")
             return
 
+        except Exception:
+            logger.exception("❌ Worker error")
+            return
+
+        finally:
+            # Speculative fetches the LLM did not list as data sources
+            for task in prefetched.values():
+                task.cancel()
+
 
 # ---------------------------------------------------------------------------
 # API ENDPOINT — RETURNS 200 IMMEDIATELY (RULE REQUIREMENT)
 # ---------------------------------------------------------------------------
-@app.post("/")
-async def handle_quiz(task: QuizRequest, bg: BackgroundTasks):
+async def verify(task: QuizRequest = Body(...)) -> QuizRequest:
+    """Reject requests whose secret doesn't match (constant-time compare)."""
+    if not STUDENT_SECRET or not compare_digest(task.secret.encode(), STUDENT_SECRET.encode()):
+        raise HTTPException(status_code=403, detail="Invalid secret")
+    return task
 
-    print(f"\n📩 Incoming request: {task.url}")
 
-    # Validate secret
-    if task.secret != STUDENT_SECRET:
-        raise HTTPException(status_code=403, detail="Invalid secret")
+@app.post("/")
+async def handle_quiz(bg: BackgroundTasks, task: QuizRequest = Depends(verify)):
+
+    logger.info("📩 Incoming request: %s", task.url)
 
     # Start background solving
     bg.add_task(solve_quiz_chain, task.url)